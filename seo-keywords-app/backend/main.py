@@ -2,18 +2,31 @@
 import os
 import re
 import json
+import time
 import uuid
+import atexit
+import asyncio
+import shutil
+import hashlib
 import tempfile
-from typing import List, Dict
+import threading
+from xml.sax.saxutils import escape
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, List, Dict, Optional, Union
 
-import pdfplumber
 import docx
+import pymupdf
+import numpy as np
+import orjson
 import pandas as pd
+import tiktoken
 from docx import Document
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls, qn
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
-from openai import OpenAI
+from openai import AsyncOpenAI
 from pytrends.request import TrendReq
 
 
@@ -27,126 +40,540 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# MuPDF prints recoverable PDF errors to stderr; this switch is process-wide
+pymupdf.TOOLS.mupdf_display_errors(False)
+
 # ---------- OpenAI client ----------
 # Requires OPENAI_API_KEY in the environment
-client = OpenAI()
+client = AsyncOpenAI()
+
+
+# ---------- JSON-file TTL cache (LLM responses, Trends scores) ----------
+class JsonTTLCache:
+    """
+    Tiny exact-match cache (LLM outputs, Trends scores), persisted as a JSON file.
+    Entries are {key: {"value": <json value>, "expires": unix_ts}}.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+        except (OSError, ValueError):
+            self._data = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry.get("expires", 0) < time.time():
+                self._data.pop(key, None)
+                return None
+            return entry.get("value")
+
+    def set(self, key: str, value: Any, ttl: int = 86400):
+        with self._lock:
+            self._data[key] = {"value": value, "expires": time.time() + ttl}
+
+    def save(self):
+        with self._lock:
+            now = time.time()
+            data = {k: v for k, v in self._data.items() if v.get("expires", 0) >= now}
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass  # cache is best-effort
+
+
+llm_cache = JsonTTLCache("/tmp/llm_cache.json")
+atexit.register(llm_cache.save)
+
+
+def _llm_cache_key(model: str, prompt: Union[str, List[Dict]], text: Dict) -> str:
+    raw = json.dumps({"model": model, "input": prompt, "text": text}, sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class EmptyLLMResponse(RuntimeError):
+    """The model returned no output_text (e.g. status "incomplete" after reasoning)."""
+
+
+async def ask_llm(
+    prompt: Union[str, List[Dict]],
+    model: str = "gpt-5",
+    text: Optional[Dict] = None,
+    parse: Optional[Callable[[str], Any]] = None,
+) -> Any:
+    """
+    Call the Responses API and return output_text, served from llm_cache when possible.
+    `prompt` is a plain string or a list of {"role", "content"} messages.
+    If `parse` is given, its result is returned instead, and the output is only
+    cached once parsing succeeds (a bad reply is never replayed from the cache).
+    Raises EmptyLLMResponse when the reply has no output_text.
+    """
+    parse = parse or (lambda s: s)
+    text = text or {"verbosity": "low"}
+    key = _llm_cache_key(model, prompt, text)
+    cached = llm_cache.get(key)
+    if cached:
+        return parse(cached)
+
+    response = await client.responses.create(model=model, input=prompt, text=text)
+    output_text = getattr(response, "output_text", None)
+    if not output_text:
+        status = getattr(response, "status", None)
+        raise EmptyLLMResponse(f"model returned no text (status: {status})")
+    result = parse(output_text)
+    llm_cache.set(key, output_text, ttl=86400)
+    return result
+
+
+# ---------- Semantic document cache ----------
+class SemanticCache:
+    """
+    Near-duplicate lookup over document embeddings.
+    Vectors live in a .npy matrix (L2-normalized rows, so dot product == cosine);
+    the matching results live in a sidecar JSON list with the same row order,
+    as {"value": ..., "expires": unix_ts} entries.
+    """
+
+    def __init__(
+        self,
+        index_path: str = "/tmp/seo_semcache.npy",
+        meta_path: str = "/tmp/seo_semcache.json",
+        threshold: float = 0.92,
+        max_entries: int = 200,
+        ttl: int = 86400,
+    ):
+        self.index_path = index_path
+        self.meta_path = meta_path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # _lock guards the in-memory state only (get() takes it on the event loop);
+        # _write_lock serializes the slow file writes.
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._vecs: Optional[np.ndarray] = None
+        self._meta: List[Dict] = []
+        try:
+            vecs = np.load(index_path)
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if len(meta) == len(vecs) and all("expires" in m for m in meta):
+                self._vecs, self._meta = vecs, meta
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _normalize(emb) -> np.ndarray:
+        v = np.asarray(emb, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def get(self, emb) -> Optional[Dict]:
+        with self._lock:
+            if self._vecs is None or not len(self._vecs):
+                return None
+            v = self._normalize(emb)
+            if v.shape[0] != self._vecs.shape[1]:
+                return None
+            sims = self._vecs @ v
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+            entry = self._meta[best]
+            if entry["expires"] < time.time():
+                return None  # dropped on the next put()
+            return entry["value"]
+
+    def put(self, emb, value: Dict):
+        """
+        Add an entry (dropping the oldest beyond max_entries) and persist both files.
+        Blocking file I/O: call it via asyncio.to_thread from async code.
+        """
+        v = self._normalize(emb)[None, :]
+        with self._lock:
+            if self._vecs is None or self._vecs.shape[1] != v.shape[1]:
+                self._vecs, self._meta = v, []
+            else:
+                self._vecs = np.vstack([self._vecs, v])
+            self._meta.append({"value": value, "expires": time.time() + self.ttl})
+            now = time.time()
+            live = [i for i, m in enumerate(self._meta) if m["expires"] >= now]
+            if len(live) < len(self._meta):
+                self._vecs = self._vecs[live]
+                self._meta = [self._meta[i] for i in live]
+            if len(self._meta) > self.max_entries:
+                self._vecs = self._vecs[-self.max_entries :]
+                self._meta = self._meta[-self.max_entries :]
+
+        with self._write_lock:
+            # Snapshot under the write lock so the last writer always saves the newest state
+            with self._lock:
+                vecs, meta = self._vecs, list(self._meta)
+            try:
+                with open(f"{self.index_path}.tmp", "wb") as f:
+                    np.save(f, vecs)
+                with open(f"{self.meta_path}.tmp", "w", encoding="utf-8") as f:
+                    json.dump(meta, f)
+                os.replace(f"{self.index_path}.tmp", self.index_path)
+                os.replace(f"{self.meta_path}.tmp", self.meta_path)
+            except OSError:
+                pass  # cache is best-effort
+
+
+semantic_cache = SemanticCache()
+
+
+async def embed_texts(texts: List[str]) -> Optional[np.ndarray]:
+    """
+    Embed all texts in a single request (one row per input); None if the call fails.
+    """
+    if not texts:
+        return None
+    try:
+        resp = await client.embeddings.create(model="text-embedding-3-small", input=texts)
+        return np.array([d.embedding for d in resp.data], dtype=np.float32)
+    except Exception:
+        return None
+
+
+async def embed_text(text: str) -> Optional[np.ndarray]:
+    """
+    One cheap embedding of the document (first 8000 chars); None if the call fails.
+    """
+    vecs = await embed_texts([text[:8000]])
+    return vecs[0] if vecs is not None else None
+
+
+def keyword_relevance(kw_vecs: np.ndarray, doc_emb: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity of every keyword to the document, as one matrix-vector product.
+    """
+    kw_unit = kw_vecs / np.maximum(np.linalg.norm(kw_vecs, axis=1, keepdims=True), 1e-12)
+    doc_unit = doc_emb / max(float(np.linalg.norm(doc_emb)), 1e-12)
+    return kw_unit @ doc_unit
 
 
 # ---------- Helpers ----------
 def extract_text_from_pdf(path: str) -> str:
-    chunks = []
-    with pdfplumber.open(path) as pdf:
-        for p in pdf.pages:
-            txt = p.extract_text() or ""
-            if txt:
-                chunks.append(txt)
-    return "\n".join(chunks)
+    with pymupdf.open(path) as pdf:
+        return "\n".join(txt for txt in (p.get_text("text") for p in pdf) if txt)
+
+
+_W_P, _W_R, _W_HYPERLINK = qn("w:p"), qn("w:r"), qn("w:hyperlink")
+_W_T, _W_BR, _W_TYPE = qn("w:t"), qn("w:br"), qn("w:type")
+# Same text equivalents python-docx uses for run content
+_RUN_CONTENT_TEXT = {
+    qn("w:tab"): "\t",
+    qn("w:ptab"): "\t",
+    qn("w:cr"): "\n",
+    qn("w:noBreakHyphen"): "-",
+}
+
+
+def _run_text(r) -> str:
+    parts = []
+    for el in r:
+        if el.tag == _W_T:
+            parts.append(el.text or "")
+        elif el.tag == _W_BR:
+            # Line breaks become "\n"; page/column breaks have no text
+            if el.get(_W_TYPE, "textWrapping") == "textWrapping":
+                parts.append("\n")
+        else:
+            parts.append(_RUN_CONTENT_TEXT.get(el.tag, ""))
+    return "".join(parts)
+
+
+def _paragraph_text(p) -> str:
+    parts = []
+    for child in p:
+        if child.tag == _W_R:
+            parts.append(_run_text(child))
+        elif child.tag == _W_HYPERLINK:
+            parts.extend(_run_text(r) for r in child.iterchildren(_W_R))
+    return "".join(parts)
 
 
 def extract_text_from_docx(path: str) -> str:
-    d = docx.Document(path)
-    return "\n".join([p.text for p in d.paragraphs if p.text])
+    # Walk the body XML directly instead of building python-docx Paragraph/Run proxies.
+    # Only w:r / w:hyperlink runs are read, matching Paragraph.text.
+    body = docx.Document(path).element.body
+    lines = (_paragraph_text(p) for p in body.iterchildren(_W_P))
+    return "\n".join(line for line in lines if line)
+
+
+# gpt-5 shares gpt-4o's o200k BPE. tiktoken downloads it on first use (with no
+# timeout), so it is loaded in a background thread and never on the event loop.
+_ENCODING = None
+
 
+def _load_encoding(retry_every: float = 300):
+    global _ENCODING
+    while _ENCODING is None:
+        try:
+            _ENCODING = tiktoken.encoding_for_model("gpt-4o")
+        except Exception:
+            time.sleep(retry_every)  # offline or transient failure; try again later
+
+
+threading.Thread(target=_load_encoding, name="tiktoken-loader", daemon=True).start()
 
-def _clean_json_block(s: str) -> str:
+
+def trunc(text: str, n_tokens: int) -> str:
     """
-    Remove code fences and isolate the first { ... } JSON block.
+    Cut text to at most n_tokens model tokens (character counts vary a lot by language).
+    Falls back to ~3 chars per token until the tokenizer has loaded.
     """
-    s = s.strip()
-    if s.startswith("```"):
-        s = s.strip("`")
-        s = "\n".join(s.splitlines()[1:])
-    start = s.find("{")
-    end = s.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        return s[start : end + 1]
-    return s
+    enc = _ENCODING
+    if enc is None:
+        return text[: n_tokens * 3]
+    # No token is longer than ~8 chars in practice; skip encoding the rest of the document
+    head = text[: n_tokens * 8]
+    ids = enc.encode(head, disallowed_special=())
+    return head if len(ids) <= n_tokens else enc.decode(ids[:n_tokens])
 
 
-def generate_keywords_from_doc(doc_text: str) -> Dict:
+def _balanced_end(s: str, start: int) -> int:
     """
-    Ask the model for English keywords + structure, even if the input is Spanish.
+    Index of the '}' closing the '{' at s[start], or -1 if it never closes.
+    Braces inside JSON strings are ignored.
+    """
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(s)):
+        ch = s[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+
+def _extract_json_object(s: str) -> Any:
     """
-    prompt = f"""
+    Parse the first balanced { ... } block that is valid JSON and return it.
+    Candidates that don't parse (e.g. "{city}" in prose, or an unclosed "{"
+    before the object) are skipped and the scan resumes at the next "{".
+    Raises orjson.JSONDecodeError if nothing parses.
+    """
+    start = s.find("{")
+    while start != -1:
+        end = _balanced_end(s, start)
+        if end != -1:
+            try:
+                return orjson.loads(s[start : end + 1])
+            except orjson.JSONDecodeError:
+                pass
+        start = s.find("{", start + 1)
+    return orjson.loads(s.strip())
+
+
+# Static instructions go first (system message) and the document last, so the
+# provider can reuse the cached prompt prefix across calls.
+KEYWORDS_SYSTEM_RULES = """
 You are an SEO analyst. Analyze the document and return ONLY JSON (no prose).
 Always output in ENGLISH, even if the source text is in Spanish.
 Use widely searched English terms that a traveler from Europe/US/Canada/Asia would type.
 
 Return EXACTLY this schema:
-{{
+{
   "language_detected": "<source language>",
   "primary_topics": ["..."],
   "seed_keywords": ["<15 short, high-signal head terms in ENGLISH>"],
   "long_tail_keywords": ["<20 intent-rich long-tail phrases in ENGLISH>"],
-  "by_intent": {{
+  "by_intent": {
     "informational": ["..."],
     "commercial": ["..."],
     "transactional": ["..."],
     "navigational": ["..."]
-  }},
+  },
   "questions": ["<10 common user queries in ENGLISH>"]
-}}
-
-Reference text (truncate if needed):
-\"\"\"{doc_text[:12000]}\"\"\"
+}
 """.strip()
 
-    response = client.responses.create(
-        model="gpt-5",
-        input=prompt,
-        text={"verbosity": "low"}
-    )
-    output_text = getattr(response, "output_text", None) or str(response)
-    payload = _clean_json_block(output_text)
-    data = json.loads(payload)
+
+async def generate_keywords_from_doc(doc_text: str) -> Dict:
+    """
+    Ask the model for English keywords + structure, even if the input is Spanish.
+    """
+    prompt = [
+        {"role": "system", "content": KEYWORDS_SYSTEM_RULES},
+        {
+            "role": "user",
+            "content": f'Reference text (truncate if needed):\n"""{trunc(doc_text, 4000)}"""',
+        },
+    ]
+
+    data = await ask_llm(prompt, parse=_extract_json_object)
     data.setdefault("seed_keywords", [])
     data.setdefault("long_tail_keywords", [])
     return data
 
 
+def _norm(s: str) -> str:
+    return re.sub(r"\s+", " ", s.strip().lower())
+
+
+def dedupe_keywords(keywords: List[str]) -> List[str]:
+    """
+    Drop case/whitespace variants ("Ecuador tour" vs "ecuador  tour"), keeping the first spelling.
+    """
+    seen: Dict[str, str] = {}
+    for k in keywords:
+        seen.setdefault(_norm(k), k)
+    return list(seen.values())
+
+
 def chunk(lst: List[str], n: int) -> List[List[str]]:
     return [lst[i : i + n] for i in range(0, len(lst), n)]
 
 
-def trends_popularity(
-    keywords: List[str], timeframe: str = "today 3-m", geo: str = ""
-) -> Dict[str, float]:
+class TokenBucket:
     """
-    Google Trends returns relative interest (0-100). We average over timeframe.
-    Trends allows max 5 terms per request; we batch.
+    Thread-safe token bucket: `rate` calls per second on average, bursts of up to `capacity`.
+    acquire() blocks until a token is available.
     """
-    if not keywords:
-        return {}
 
-    pytrends = TrendReq(hl="en-US", tz=360)
-    scores: Dict[str, float] = {}
+    def __init__(self, rate: float, capacity: int = 1):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Pace Trends requests (default ~1 every 1.5 s, burst of 4); 429s are handled by
+# the backoff in _fetch_trends_batch. Override with TRENDS_REQUESTS_PER_SEC.
+trends_bucket = TokenBucket(
+    rate=float(os.getenv("TRENDS_REQUESTS_PER_SEC", "0.67")), capacity=4
+)
+
+# Long-lived workers so each keeps its own TrendReq (and Google cookies) across requests
+trends_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="trends")
+_PYTRENDS = threading.local()
+
+# Per-keyword scores over a 3-month window barely move within a few hours
+trends_cache = JsonTTLCache("/tmp/trends_cache.json")
+atexit.register(trends_cache.save)
+TRENDS_TTL = 6 * 3600
+
 
-    for group in chunk(keywords, 5):
+def _get_pytrends() -> TrendReq:
+    """
+    One TrendReq per worker thread: pytrends clients are not thread-safe, but
+    reusing one skips the cookie handshake TrendReq() does on construction.
+    """
+    pt = getattr(_PYTRENDS, "client", None)
+    if pt is None:
+        pt = _PYTRENDS.client = TrendReq(hl="en-US", tz=360)
+    return pt
+
+
+def _is_rate_limited(exc: Exception) -> bool:
+    return getattr(getattr(exc, "response", None), "status_code", None) == 429
+
+
+def _fetch_trends_batch(
+    group: List[str], timeframe: str, geo: str, retries: int = 3
+) -> Optional[pd.DataFrame]:
+    """
+    One interest_over_time() call for up to 5 keywords, backing off on 429.
+    """
+    pytrends = _get_pytrends()
+    for attempt in range(retries + 1):
+        trends_bucket.acquire()
         try:
             pytrends.build_payload(group, timeframe=timeframe, geo=geo)
             df = pytrends.interest_over_time()
             if df is None or df.empty:
-                for k in group:
-                    scores.setdefault(k, None)
-                continue
-            df = df.drop(columns=["isPartial"], errors="ignore")
-            means = df.mean(numeric_only=True).to_dict()
-            for k in group:
-                scores[k] = float(means.get(k)) if k in means else None
-        except Exception:
-            for k in group:
-                scores.setdefault(k, None)
-
-    return scores
+                return None
+            return df.drop(columns=["isPartial"], errors="ignore")
+        except Exception as e:
+            if not _is_rate_limited(e) or attempt == retries:
+                return None
+            time.sleep(2 ** attempt)
+    return None
 
 
-def compose_seo_copy_en(doc_text: str, ranked_keywords: List[str]) -> str:
+def trends_popularity(
+    keywords: List[str], timeframe: str = "today 3-m", geo: str = ""
+) -> Dict[str, float]:
     """
-    Generate ORIGINAL English copy following the Spanish template, with keywords woven in.
-    Returns Markdown; at the bottom include JSON-LD FAQPage.
+    Google Trends returns relative interest (0-100). We average over timeframe.
+    Trends allows max 5 terms per request; we batch and fetch batches in parallel.
+    Scores are cached per (timeframe, geo, keyword) so only unseen keywords hit Trends.
     """
-    top_kw = ", ".join(ranked_keywords[:15]) if ranked_keywords else ""
-    prompt = f"""
+    if not keywords:
+        return {}
+
+    def cache_key(k: str) -> str:
+        return f"{timeframe}|{geo}|{k}"
+
+    cached: Dict[str, float] = {}
+    missing: List[str] = []
+    for k in keywords:
+        v = trends_cache.get(cache_key(k))
+        if v is None:
+            missing.append(k)
+        else:
+            cached[k] = v
+
+    frames: List[pd.DataFrame] = []
+    if missing:
+        futures = [
+            trends_pool.submit(_fetch_trends_batch, group, timeframe, geo)
+            for group in chunk(missing, 5)
+        ]
+        for fut in as_completed(futures):
+            df = fut.result()
+            if df is not None:
+                frames.append(df)
+
+    # One reduction over all batches instead of one per batch
+    means = pd.concat(frames, axis=1).mean(numeric_only=True).to_dict() if frames else {}
+    for k in missing:
+        if k in means:
+            cached[k] = float(means[k])
+            trends_cache.set(cache_key(k), cached[k], ttl=TRENDS_TTL)
+
+    return {k: cached.get(k) for k in keywords}
+
+
+COPY_SYSTEM_RULES = """
 You are a senior SEO copywriter for an inbound tour operator in Ecuador targeting travelers from
 Europe, the US/Canada, and occasionally Asia. Write ORIGINAL ENGLISH copy (no plagiarism).
 
@@ -160,42 +587,75 @@ Follow this EXACT structure (H2/H3 + bullets):
 ### Map or infographic (short caption text describing what to show)
 
 Rules:
-- Weave these keywords naturally (no stuffing, ~1–2% density): {top_kw}
+- Weave the keywords given by the user naturally (no stuffing, ~1–2% density).
 - Tone: clear, trustworthy, inspiring; emphasize authenticity, sustainability, safety.
 - Avoid medical/legal claims; use soft guidance and official-source disclaimers.
+- Rewrite the reference text in your own words; do NOT copy sentences verbatim.
 - End with:
   - Meta title (≤ 60 chars)
   - Meta description (≤ 155 chars)
   - Suggested slugs (5)
   - JSON-LD FAQPage with 6–8 FAQs (valid JSON)
-
-Reference (rewrite in your own words; do NOT copy sentences verbatim):
-\"\"\"{doc_text[:10000]}\"\"\"
 """.strip()
 
-    resp = client.responses.create(
-        model="gpt-5",
-        input=prompt,
-        text={"verbosity": "low"}
-    )
-    return getattr(resp, "output_text", None) or str(resp)
+
+async def compose_seo_copy_en(doc_text: str, ranked_keywords: List[str]) -> str:
+    """
+    Generate ORIGINAL English copy following the Spanish template, with keywords woven in.
+    Returns Markdown; at the bottom include JSON-LD FAQPage.
+    """
+    top_kw = ", ".join(ranked_keywords[:15]) if ranked_keywords else ""
+    prompt = [
+        {"role": "system", "content": COPY_SYSTEM_RULES},
+        {
+            "role": "user",
+            "content": f'Keywords: {top_kw}\n\nReference:\n"""{trunc(doc_text, 3000)}"""',
+        },
+    ]
+
+    return await ask_llm(prompt)
+
+
+_BULLET_RE = re.compile(r"^\s*-\s+")
+# Characters XML 1.0 cannot represent (the model occasionally emits them)
+_XML_INVALID_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _paragraph_xml(text: str, style: Optional[str] = None) -> str:
+    ppr = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+    if not text:
+        return f"<w:p>{ppr}</w:p>"
+    text = escape(_XML_INVALID_RE.sub("", text))
+    return f'<w:p>{ppr}<w:r><w:t xml:space="preserve">{text}</w:t></w:r></w:p>'
 
 
 def markdown_to_docx(md_text: str, out_path: str):
     """
     Very lightweight Markdown -> DOCX so you can download a .docx file.
     (Headings ## and ###, simple bullets)
+    Paragraph XML is built as one fragment and appended to the body in a single pass.
     """
-    doc = Document()
+    paragraphs = []
     for line in md_text.splitlines():
         if line.startswith("## "):
-            doc.add_heading(line[3:], level=1)
+            paragraphs.append(_paragraph_xml(line[3:], "Heading1"))
         elif line.startswith("### "):
-            doc.add_heading(line[4:], level=2)
-        elif re.match(r"^\s*-\s+", line):
-            doc.add_paragraph(re.sub(r"^\s*-\s+", "", line), style="List Bullet")
+            paragraphs.append(_paragraph_xml(line[4:], "Heading2"))
+        elif m := _BULLET_RE.match(line):
+            paragraphs.append(_paragraph_xml(line[m.end():], "ListBullet"))
         else:
-            doc.add_paragraph(line)
+            paragraphs.append(_paragraph_xml(line))
+
+    doc = Document()
+    body = doc.element.body
+    fragment = parse_xml(f"<w:body {nsdecls('w')}>{''.join(paragraphs)}</w:body>")
+    # Section properties must stay the last child of <w:body>
+    sect_pr = body.find(qn("w:sectPr"))
+    if sect_pr is not None:
+        body.remove(sect_pr)
+    body.extend(list(fragment))
+    if sect_pr is not None:
+        body.append(sect_pr)
     doc.save(out_path)
 
 
@@ -205,61 +665,115 @@ def health():
     return {"status": "ok"}
 
 
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    If-None-Match uses weak comparison: "W/" prefixes are ignored and "*" matches anything.
+    """
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
 @app.get("/download/{name}")
-def download_docx(name: str):
+def download_docx(name: str, request: Request):
     path = f"/tmp/{name}"
-    if not os.path.exists(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found")
+
+    # Drafts never change once written, so mtime+size identifies the content
+    etag = f'"{int(st.st_mtime_ns):x}-{st.st_size:x}"'
+    if _etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # Passing stat_result skips FileResponse's own stat; the body is sent with
+    # sendfile when the server supports it.
     return FileResponse(
         path,
         media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
         filename=name,
+        stat_result=st,
+        headers={"ETag": etag},
     )
 
 
 @app.post("/upload")
 async def upload(file: UploadFile = File(...)):
-    # Save to a temp file
+    # Save to a temp file (streamed in 1 MB chunks, never fully in memory)
     with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp.write(await file.read())
+        await asyncio.to_thread(shutil.copyfileobj, file.file, tmp, 1 << 20)
         tmp_path = tmp.name
 
-    # Extract text based on extension
+    # Extract text based on extension (in a worker thread; parsing is CPU-bound)
     name_lower = file.filename.lower()
     if name_lower.endswith(".pdf"):
-        text = extract_text_from_pdf(tmp_path)
+        text = await asyncio.to_thread(extract_text_from_pdf, tmp_path)
     elif name_lower.endswith(".docx"):
-        text = extract_text_from_docx(tmp_path)
+        text = await asyncio.to_thread(extract_text_from_docx, tmp_path)
     else:
         raise HTTPException(status_code=400, detail="Unsupported file type. Use .pdf or .docx")
 
     if not text.strip():
         raise HTTPException(status_code=422, detail="No readable text found in the document.")
 
+    # (0) Near-duplicate of a previous upload? Reuse its LLM output.
+    doc_emb = await embed_text(text)
+    hit = semantic_cache.get(doc_emb) if doc_emb is not None else None
+
     # (1) Get structured EN keywords & intents
-    seo_data = generate_keywords_from_doc(text)
+    seo_data = hit["seo_data"] if hit else await generate_keywords_from_doc(text)
 
     # (2) Build candidate list (seed + some long-tail)
     seeds = list(dict.fromkeys(seo_data.get("seed_keywords", [])))[:15]
     longtails = list(dict.fromkeys(seo_data.get("long_tail_keywords", [])))[:15]
-    candidates = seeds + longtails
-
-    # (3) Google Trends popularity (last 3 months)
-    popularity = trends_popularity(candidates, timeframe="today 3-m")
-
-    # (4) Sort keywords by popularity (None -> bottom)
-    def sort_key(k):
-        v = popularity.get(k)
-        return (-v) if isinstance(v, (int, float)) else float("-inf")
-
-    ranked = sorted(candidates, key=sort_key, reverse=True)
-    keywords_ranked = [{"keyword": k, "popularity": popularity.get(k)} for k in ranked]
-
-    # (5) Compose English SEO copy that follows your template
-    try:
-        seo_copy_md = compose_seo_copy_en(text, ranked)
-    except Exception as e:
-        seo_copy_md = f"Error generating SEO copy: {e}"
+    candidates = dedupe_keywords(seeds + longtails)
+
+    # (3) Google Trends popularity (last 3 months) and (4) English SEO copy
+    # run concurrently: the copy only needs the candidate keywords, not their rank.
+    # Keyword embeddings (one batched call) ride along for relevance tie-breaking.
+    trends_task = asyncio.to_thread(trends_popularity, candidates, "today 3-m")
+    kw_task = embed_texts(candidates) if doc_emb is not None else asyncio.sleep(0)
+    if hit:
+        popularity, kw_vecs = await asyncio.gather(trends_task, kw_task)
+        seo_copy_md = hit["seo_copy_md"]
+    else:
+        copy_task = asyncio.create_task(compose_seo_copy_en(text, candidates))
+        popularity, kw_vecs, copy_result = await asyncio.gather(
+            trends_task, kw_task, copy_task, return_exceptions=True
+        )
+        if isinstance(popularity, Exception):
+            raise popularity
+        if isinstance(copy_result, Exception):
+            seo_copy_md = f"Error generating SEO copy: {copy_result}"
+        else:
+            seo_copy_md = copy_result
+            if doc_emb is not None:
+                await asyncio.to_thread(
+                    semantic_cache.put, doc_emb, {"seo_data": seo_data, "seo_copy_md": seo_copy_md}
+                )
+
+    # (5) Sort keywords by popularity (None -> bottom), ties by relevance to the document
+    scores = np.array(
+        [v if isinstance(v := popularity.get(k), (int, float)) else -np.inf for k in candidates],
+        dtype=np.float64,
+    )
+    if isinstance(kw_vecs, np.ndarray) and len(kw_vecs) == len(candidates):
+        relevance = keyword_relevance(kw_vecs, doc_emb)
+        order = np.lexsort((-relevance, -scores))
+    else:
+        relevance = None
+        order = np.argsort(-scores, kind="stable")
+    keywords_ranked = [
+        {
+            "keyword": candidates[i],
+            "popularity": popularity.get(candidates[i]),
+            "relevance": round(float(relevance[i]), 4) if relevance is not None else None,
+        }
+        for i in order
+    ]
 
     # (6) Optional DOCX export
     docx_name = None
@@ -269,7 +783,7 @@ async def upload(file: UploadFile = File(...)):
     except Exception:
         docx_name = None  # ignore conversion errors
 
-    return {
+    result = {
         "language_detected": seo_data.get("language_detected"),
         "primary_topics": seo_data.get("primary_topics", []),
         "by_intent": seo_data.get("by_intent", {}),
@@ -280,6 +794,7 @@ async def upload(file: UploadFile = File(...)):
         "seo_copy_markdown": seo_copy_md,
         "docx_filename": docx_name,
     }
+    return Response(orjson.dumps(result), media_type="application/json")
 
 
 # ---------- Run (optional) ----------